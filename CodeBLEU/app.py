@@ -1,30 +1,79 @@
-from flask import Flask, request, render_template, jsonify, flash, redirect, url_for
+from flask import Flask, Response, request, render_template, flash, redirect, url_for
 from flask_cors import CORS
+import orjson
+import hashlib
+import multiprocessing
 import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from codebleu import calc_codebleu
 
 app = Flask(__name__)
 CORS(app)
 
 UPLOAD_FOLDER = 'uploads'
-ALLOWED_EXTENSIONS = {'txt', 'py', 'java', 'cpp', 'c', 'js', 'ts', 'go', 'rb', 'php', 'cs', 'swift', 'kt', 'scala', 'rs'}
+ALLOWED_EXTENSIONS = frozenset({'txt', 'py', 'java', 'cpp', 'c', 'js', 'ts', 'go', 'rb', 'php', 'cs', 'swift', 'kt', 'scala', 'rs'})
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024 
+# Per-file limit on decoded source; real code files are far below this, and larger
+# inputs only make the tree-sitter parse and n-gram matching expensive
+MAX_CODE_LENGTH = 256 * 1024
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Tokenizer patterns are compiled once at import instead of on every request
+_DEFAULT_TOK_RE = re.compile(r'\w+|[^\w\s]')
+# Custom tokenizer scanner: comments and tokens are matched in one pass, and only the
+# token group captures. The block comment body alternates runs of non-stars with star
+# runs not followed by '/', which never overlap, so matching stays linear; an
+# unterminated block comment runs to end of input, as it would for a real C/JS lexer.
+_CUSTOM_SCAN_RE = re.compile(
+    r'(?://[^\n]*|/\*[^*]*(?:\*+(?!/)[^*]*)*(?:\*/|\Z))'
+    r'|(\b\w+\b|[{}();,\[\].]|[+\-*/=<>!&|])'
+)
+
+# Recently computed CodeBLEU results keyed by content digests of the code pair
+SCORE_CACHE_SIZE = 256
+_score_cache = OrderedDict()
+_score_cache_lock = threading.Lock()
+
+# CodeBLEU scoring runs in worker processes so it does not hold up the request thread.
+# The pool is started when a gunicorn worker boots (or on first use), never at import,
+# and each of its processes warms up before taking a job. Its size can be capped with
+# CODEBLEU_SCORING_WORKERS, which gunicorn_conf.py sets so that all gunicorn workers'
+# pools together roughly match the core count.
+SCORING_WORKERS = int(os.environ.get('CODEBLEU_SCORING_WORKERS', os.cpu_count() or 1))
+_pool = None
+_pool_lock = threading.Lock()
+
 def allowed_file(filename):
     """Check if the uploaded file has an allowed extension"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    dot = filename.rfind('.')
+    return dot >= 0 and filename[dot + 1:].lower() in ALLOWED_EXTENSIONS
+
+def read_code(file_storage):
+    """Decode an uploaded file as UTF-8, replacing invalid bytes and keeping line endings as uploaded"""
+    return file_storage.read().decode('utf-8', 'replace')
+
+def check_code(code, filename):
+    """Return an (error, status) pair if decoded upload content should not be scored, else None"""
+    if len(code) > MAX_CODE_LENGTH:
+        return f'{filename} is too large. Maximum size is {MAX_CODE_LENGTH // 1024} KB', 413
+    if '\x00' in code:
+        return f'{filename} appears to be a binary file', 400
+    return None
 
 def default_tokenizer(code):
     """
     Default simple tokenizer - splits code by whitespace and common delimiters
     You can replace this with your custom tokenizer function
     """
-    import re
     # Split by whitespace and common programming delimiters
-    tokens = re.findall(r'\w+|[^\w\s]', code)
+    tokens = _DEFAULT_TOK_RE.findall(code)
     return tokens
 
 def custom_tokenizer(code):
@@ -32,18 +81,162 @@ def custom_tokenizer(code):
     Custom tokenizer function - customize this as needed
     This is a placeholder for your custom implementation
     """
-    import re
+    # Skip comments and split into tokens considering programming constructs in a
+    # single scan; comment matches capture nothing and come back as empty strings.
+    # Tokens are interned so the many repeats of '(' or 'def' share one object and
+    # hash/compare by identity in CodeBLEU's n-gram counters.
+    return [sys.intern(token) for token in _CUSTOM_SCAN_RE.findall(code) if token]
+
+# Tokenizer handed to CodeBLEU for each mode of the upload form. None keeps CodeBLEU's
+# own whitespace split, which is what the default mode has always scored with.
+_TOKENIZERS = {
+    'custom': custom_tokenizer,
+    'default': None,
+}
+
+def _requested_tokenizer():
+    """Return the (name, tokenizer) pair selected by the upload form"""
+    name = 'custom' if request.form.get('use_custom_tokenizer') == 'true' else 'default'
+    return name, _TOKENIZERS[name]
+
+def _get_pool():
+    """Return the shared scoring process pool, creating it on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Request threads are already running when the pool starts, so its processes
+            # come from a forkserver rather than a fork of this multithreaded process
+            context = None
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('forkserver')
+            _pool = ProcessPoolExecutor(max_workers=SCORING_WORKERS, mp_context=context,
+                                        initializer=_warm_up)
+        return _pool
+
+def start_scoring_pool():
+    """
+    Create the scoring pool and start all of its processes now rather than inside
+    the first requests. Called from gunicorn's post_worker_init hook; blocks until
+    every process has warmed up.
+    """
+    pool = _get_pool()
+    # One trivial job per process; they are submitted before any process is up, so
+    # each one spawns its own process, whose initializer runs before the job
+    for future in [pool.submit(int) for _ in range(SCORING_WORKERS)]:
+        future.result()
+
+def _discard_pool(pool):
+    """Drop a pool whose processes died so the next _get_pool call starts a fresh one"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+def _run_scoring(jobs):
+    """
+    Score each (reference_codes, predicted_codes, tokenizer) job in the process pool.
+    A scoring process killed mid-job (OOM, a crashing parser) breaks the whole pool,
+    so the pool is replaced and the jobs are retried once before giving up.
+    """
+    for attempt in range(2):
+        pool = _get_pool()
+        try:
+            futures = [pool.submit(_calc, *job) for job in jobs]
+            return [future.result() for future in futures]
+        except BrokenProcessPool:
+            _discard_pool(pool)
+            if attempt:
+                raise
+
+def _calc(reference_codes, predicted_codes, tokenizer):
+    """Run CodeBLEU over aligned references and predictions; executed inside the process pool"""
+    return calc_codebleu(
+        references=[[reference_code] for reference_code in reference_codes],
+        predictions=list(predicted_codes),
+        lang="python",
+        weights=(0.25, 0.25, 0.25, 0.25),
+        tokenizer=tokenizer
+    )
+
+def _warm_up():
+    """
+    Score a trivial pair once so tree-sitter's Python grammar is loaded when a
+    scoring process starts instead of inside its first job. Runs as the pool's
+    process initializer.
+    """
+    try:
+        _calc(['a'], ['a'], None)
+    except Exception:
+        pass
+
+def _digest(code):
+    """Short content hash used as a cache key for large code strings"""
+    return hashlib.blake2b(code.encode('utf-8'), digest_size=16).digest()
+
+def _cache_get(key):
+    """Return the cached CodeBLEU result for key, or None, marking it recently used"""
+    with _score_cache_lock:
+        if key in _score_cache:
+            _score_cache.move_to_end(key)
+            return _score_cache[key]
+    return None
+
+def _cache_put(key, result):
+    """Store a CodeBLEU result, evicting the least recently used entry when full"""
+    with _score_cache_lock:
+        _score_cache[key] = result
+        if len(_score_cache) > SCORE_CACHE_SIZE:
+            _score_cache.popitem(last=False)
+
+def score_codebleu_batch(reference_codes, predicted_codes, tokenizer=None):
+    """
+    Calculate CodeBLEU separately for each aligned (reference, predicted) pair.
+    Recently scored pairs are reused from the cache, since CodeBLEU is a pure
+    function of its inputs; the rest are scored concurrently in the process pool.
+    """
+    keys = [(_digest(ref), _digest(pred), tokenizer) for ref, pred in zip(reference_codes, predicted_codes)]
+    results = {}
     
-    # Remove comments (basic implementation)
-    code = re.sub(r'//.*?$|/\*.*?\*/', '', code, flags=re.MULTILINE | re.DOTALL)
+    for key in keys:
+        cached = _cache_get(key)
+        if cached is not None:
+            results[key] = cached
     
-    # Split into tokens considering programming constructs
-    tokens = re.findall(r'\b\w+\b|[{}();,\[\].]|[+\-*/=<>!&|]', code)
+    pending = {}
+    for key, ref, pred in zip(keys, reference_codes, predicted_codes):
+        if key not in results and key not in pending:
+            pending[key] = ([ref], [pred], tokenizer)
     
-    # Filter out empty tokens
-    tokens = [token.strip() for token in tokens if token.strip()]
+    for key, result in zip(pending, _run_scoring(pending.values())):
+        results[key] = result
+        _cache_put(key, result)
     
-    return tokens
+    return [results[key] for key in keys]
+
+def score_codebleu_corpus(reference_codes, predicted_codes, tokenizer=None):
+    """Calculate one corpus-level CodeBLEU over all pairs, reusing the result if it was scored recently"""
+    key = ('corpus', tuple(map(_digest, reference_codes)), tuple(map(_digest, predicted_codes)), tokenizer)
+    result = _cache_get(key)
+    if result is None:
+        result = _run_scoring([(reference_codes, predicted_codes, tokenizer)])[0]
+        _cache_put(key, result)
+    return result
+
+def score_codebleu(reference_code, predicted_code, tokenizer=None):
+    """Calculate CodeBLEU for a single pair, reusing the result if it was scored recently"""
+    return score_codebleu_batch([reference_code], [predicted_code], tokenizer)[0]
+
+def _summarize(result):
+    """Split a CodeBLEU result into its main score and the detailed score dict"""
+    if isinstance(result, dict):
+        return result.get('codebleu', 0.0), result
+    main_score = float(result)
+    return main_score, {'codebleu': main_score}
+
+def _json(obj, status=200):
+    """Build a JSON response, encoding with orjson rather than the stdlib json module"""
+    return Response(orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY), status=status, mimetype='application/json')
 
 @app.route('/')
 def index():
@@ -54,65 +247,119 @@ def index():
 def upload_files():
     """Handle file uploads and calculate CodeBLEU score"""
     try:
+        # Reject an empty body before Werkzeug parses the multipart form
+        if request.content_length == 0:
+            return _json({'error': 'Both reference and predicted files are required'}, 400)
+        
         if 'reference_file' not in request.files or 'predicted_file' not in request.files:
-            return jsonify({'error': 'Both reference and predicted files are required'}), 400
+            return _json({'error': 'Both reference and predicted files are required'}, 400)
         
         reference_file = request.files['reference_file']
         predicted_file = request.files['predicted_file']
-        use_custom_tokenizer = request.form.get('use_custom_tokenizer') == 'true'
+        tokenizer_name, tokenizer = _requested_tokenizer()
         
         if reference_file.filename == '' or predicted_file.filename == '':
-            return jsonify({'error': 'Please select both files'}), 400
+            return _json({'error': 'Please select both files'}, 400)
         
         if not (allowed_file(reference_file.filename) and allowed_file(predicted_file.filename)):
-            return jsonify({'error': 'File type not allowed. Supported types: ' + ', '.join(ALLOWED_EXTENSIONS)}), 400
-        
-        reference_code = reference_file.read().decode('utf-8')
-        predicted_code = predicted_file.read().decode('utf-8')
-        
-        if use_custom_tokenizer:
-            tokenizer = custom_tokenizer
-            reference_tokens = tokenizer(reference_code)
-            predicted_tokens = tokenizer(predicted_code)
-            reference_processed = ' '.join(reference_tokens)
-            predicted_processed = ' '.join(predicted_tokens)
-        else:
-            reference_processed = reference_code
-            predicted_processed = predicted_code
-        
-        references = [[reference_processed]]  
-        predictions = [predicted_processed]   
-        
-        result = calc_codebleu(
-            references=references,
-            predictions=predictions,
-            lang="python",
-            weights=(0.25, 0.25, 0.25, 0.25)
-        )
-        
-        if isinstance(result, dict):
-            main_score = result.get('codebleu', 0.0)
-        else:
-            main_score = float(result)
+            return _json({'error': 'File type not allowed. Supported types: ' + ', '.join(ALLOWED_EXTENSIONS)}, 400)
+        
+        reference_code = read_code(reference_file)
+        predicted_code = read_code(predicted_file)
+        
+        for upload, code in ((reference_file, reference_code), (predicted_file, predicted_code)):
+            problem = check_code(code, upload.filename)
+            if problem:
+                return _json({'error': problem[0]}, problem[1])
+        
+        result = score_codebleu(reference_code, predicted_code, tokenizer)
+        
+        main_score, detailed_scores = _summarize(result)
         
         response = {
             'success': True,
             'codebleu_score': main_score,
             'reference_length': len(reference_code),
             'predicted_length': len(predicted_code),
-            'tokenizer_used': 'custom' if use_custom_tokenizer else 'default',
-            'detailed_scores': result if isinstance(result, dict) else {'codebleu': main_score}
+            'tokenizer_used': tokenizer_name,
+            'detailed_scores': detailed_scores
         }
         
-        return jsonify(response)
+        return _json(response)
+        
+    except BrokenProcessPool:
+        return _json({'error': 'Scoring is temporarily unavailable, please try again'}, 503)
+    except Exception as e:
+        return _json({'error': f'An error occurred: {str(e)}'}, 500)
+
+@app.route('/upload_batch', methods=['POST'])
+def upload_batch():
+    """Handle multi-file uploads and calculate CodeBLEU for each reference/predicted pair"""
+    try:
+        if request.content_length == 0:
+            return _json({'error': 'Both reference and predicted files are required'}, 400)
+        
+        reference_files = request.files.getlist('reference_files[]')
+        predicted_files = request.files.getlist('predicted_files[]')
+        tokenizer_name, tokenizer = _requested_tokenizer()
+        
+        if not reference_files or not predicted_files:
+            return _json({'error': 'Both reference and predicted files are required'}, 400)
+        
+        if len(reference_files) != len(predicted_files):
+            return _json({'error': 'The number of reference and predicted files must match'}, 400)
+        
+        uploads = reference_files + predicted_files
+        if any(upload.filename == '' for upload in uploads):
+            return _json({'error': 'Please select all files'}, 400)
+        
+        if not all(allowed_file(upload.filename) for upload in uploads):
+            return _json({'error': 'File type not allowed. Supported types: ' + ', '.join(ALLOWED_EXTENSIONS)}, 400)
+        
+        reference_codes = [read_code(upload) for upload in reference_files]
+        predicted_codes = [read_code(upload) for upload in predicted_files]
+        
+        for upload, code in zip(uploads, reference_codes + predicted_codes):
+            problem = check_code(code, upload.filename)
+            if problem:
+                return _json({'error': problem[0]}, problem[1])
+        
+        results = score_codebleu_batch(reference_codes, predicted_codes, tokenizer)
+        
+        scores = []
+        for reference_file, predicted_file, result in zip(reference_files, predicted_files, results):
+            main_score, detailed_scores = _summarize(result)
+            scores.append({
+                'reference_file': reference_file.filename,
+                'predicted_file': predicted_file.filename,
+                'codebleu_score': main_score,
+                'detailed_scores': detailed_scores
+            })
+        
+        response = {
+            'success': True,
+            'pair_count': len(scores),
+            'tokenizer_used': tokenizer_name,
+            'scores': scores
+        }
+        
+        # A corpus-level score rescans every pair, so it is only computed when asked for
+        if request.form.get('corpus_score') == 'true':
+            corpus_result = score_codebleu_corpus(reference_codes, predicted_codes, tokenizer)
+            response['codebleu_score'], response['detailed_scores'] = _summarize(corpus_result)
+        
+        return _json(response)
         
+    except BrokenProcessPool:
+        return _json({'error': 'Scoring is temporarily unavailable, please try again'}, 503)
     except Exception as e:
-        return jsonify({'error': f'An error occurred: {str(e)}'}), 500
+        return _json({'error': f'An error occurred: {str(e)}'}, 500)
 
 @app.route('/health')
 def health():
     """Health check endpoint"""
-    return jsonify({'status': 'healthy'})
+    return _json({'status': 'healthy'})
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # Development server only; use gunicorn with gunicorn_conf.py in production
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', host='0.0.0.0', port=5000)
\ No newline at end of file
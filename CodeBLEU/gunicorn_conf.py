@@ -0,0 +1,31 @@
+"""
+Production server settings for the CodeBLEU app.
+
+Run from the CodeBLEU directory with:
+    gunicorn -c gunicorn_conf.py app:app
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+
+# Threaded workers let file uploads on one request overlap with scoring on another;
+# the CPU-bound CodeBLEU work itself runs in each worker's scoring process pool. Every
+# worker has its own pool, so keep few workers and split the cores between their pools
+# instead of multiplying them.
+workers = int(os.environ.get('GUNICORN_WORKERS', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+os.environ.setdefault('CODEBLEU_SCORING_WORKERS', str(max(1, multiprocessing.cpu_count() // workers)))
+
+# Import the app (and the heavy codebleu / tree-sitter modules) once in the master
+# so workers share it copy-on-write after fork
+preload_app = True
+
+# Scoring a large upload can take a while
+timeout = 120
+
+def post_worker_init(worker):
+    """Start this worker's scoring processes before it accepts requests"""
+    import app
+    app.start_scoring_pool()
@@ -22,21 +22,28 @@ import ast
 import re
 import sys
 import argparse
+import functools
+import importlib
 import logging
-from typing import List, Dict, Tuple, Optional, Union, Any
+import threading
+from typing import AbstractSet, FrozenSet, Iterator, List, Dict, Sequence, Tuple, Optional, Union, Any
 from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
 from datetime import datetime
 import math
 
 try:
     import tree_sitter
-    from tree_sitter import Language, Parser
+    from tree_sitter import Language, Parser, Query, QueryCursor
 except ImportError:
     print("Warning: tree-sitter not available. AST analysis will use Python's ast module only.")
     tree_sitter = None
 
 try:
     import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
 except ImportError:
     print("Warning: requests not available. API integration disabled.")
     requests = None
@@ -45,12 +52,180 @@ except ImportError:
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Tree-sitter queries capturing the names of the structures `_extract_code_structures` collects
+_TS_STRUCT_QUERIES = {
+    'javascript': """
+        (function_declaration name: (identifier) @name)
+        (class_declaration name: (identifier) @name)
+        (pair key: (property_identifier) @name value: (function_expression))
+        (variable_declarator name: (identifier) @name value: (arrow_function))
+    """,
+    'java': """
+        (class_declaration name: (identifier) @name)
+        (interface_declaration name: (identifier) @name)
+        (method_declaration name: (identifier) @name)
+    """
+}
+_TS_GRAMMAR_MODULES = {'javascript': 'tree_sitter_javascript', 'java': 'tree_sitter_java'}
+
+# Grammars and compiled queries are loaded once per process, keyed by (language, query kind)
+_TS_LANGUAGES: Dict[str, Any] = {}
+_TS_QUERIES: Dict[Tuple[str, str], Any] = {}
+if tree_sitter is not None:
+    for _language, _module in _TS_GRAMMAR_MODULES.items():
+        try:
+            _TS_LANGUAGES[_language] = Language(importlib.import_module(_module).language())
+            _TS_QUERIES[(_language, 'structures')] = Query(_TS_LANGUAGES[_language], _TS_STRUCT_QUERIES[_language])
+        except Exception as e:
+            _TS_LANGUAGES.pop(_language, None)
+            print(f"Warning: tree-sitter grammar for {_language} not available ({e}). Using regex structure extraction.")
+
+# Parsers are not thread-safe, so each thread keeps its own per language
+_TS_PARSERS = threading.local()
+
+
+def _ts_parser(language: str) -> Any:
+    """This thread's tree-sitter parser for `language`, created on first use."""
+    parsers = getattr(_TS_PARSERS, 'parsers', None)
+    if parsers is None:
+        parsers = _TS_PARSERS.parsers = {}
+    parser = parsers.get(language)
+    if parser is None:
+        parser = parsers[language] = Parser(_TS_LANGUAGES[language])
+    return parser
+
+
+# One bit for every concrete AST node class, so the node types present in a tree
+# form an int bitset instead of a list of class-name strings
+_AST_TYPE_BITS: Dict[type, int] = {
+    cls: 1 << i for i, cls in enumerate(
+        cls for cls in vars(ast).values() if isinstance(cls, type) and issubclass(cls, ast.AST)
+    )
+}
+
+# numba and numpy take a noticeable time to import, and the kernel below has to be compiled
+# or loaded from numba's cache on first use. That only pays off over many evaluations, so
+# they are loaded once a process has scored JIT_MIN_TOKENS tokens, e.g. partway into a dataset.
+JIT_MIN_TOKENS = 250_000
+_jit_tokens_seen = 0
+_jit_loaded = False
+_jit_lock = threading.Lock()
+_clipped_counts = None
+
+
+def _load_jit_kernel():
+    """Import numba and define `_clipped_counts`; it stays None if numba is not installed."""
+    global np, nb_types, NumbaDict, _clipped_counts
+    try:
+        import numpy as np
+        from numba import njit, types as nb_types
+        from numba.typed import Dict as NumbaDict
+    except ImportError:
+        print("Warning: numba not available. BLEU n-gram matching will run in pure Python.")
+        return
+    
+    @njit(cache=True)
+    def _clipped_counts_kernel(cand_ids, cand_keywords, ref_ids, ref_offsets, n, base):
+        """
+        Clipped n-gram matches and candidate n-gram totals for integer-encoded tokens, both
+        plain and with n-grams containing a keyword (flagged in `cand_keywords`) counted twice.
+        
+        Each n-gram is packed into one int64 key as a base-`base` number, which is exact
+        as long as base ** n fits in 63 bits (checked by the caller). References are
+        concatenated in `ref_ids`, with reference r spanning ref_offsets[r]:ref_offsets[r + 1].
+        """
+        candidate_counts = NumbaDict.empty(key_type=nb_types.int64, value_type=nb_types.int64)
+        candidate_weights = NumbaDict.empty(key_type=nb_types.int64, value_type=nb_types.int64)
+        total = 0
+        weighted_total = 0
+        for i in range(cand_ids.shape[0] - n + 1):
+            key = 0
+            weight = 1
+            for k in range(n):
+                key = key * base + cand_ids[i + k]
+                if cand_keywords[i + k]:
+                    weight = 2
+            candidate_counts[key] = candidate_counts.get(key, 0) + 1
+            candidate_weights[key] = weight
+            total += 1
+            weighted_total += weight
+        
+        # Maximum occurrences of each n-gram in any single reference
+        max_counts = NumbaDict.empty(key_type=nb_types.int64, value_type=nb_types.int64)
+        for r in range(ref_offsets.shape[0] - 1):
+            ref_counts = NumbaDict.empty(key_type=nb_types.int64, value_type=nb_types.int64)
+            for i in range(ref_offsets[r], ref_offsets[r + 1] - n + 1):
+                key = 0
+                for k in range(n):
+                    key = key * base + ref_ids[i + k]
+                ref_counts[key] = ref_counts.get(key, 0) + 1
+            for key, count in ref_counts.items():
+                if count > max_counts.get(key, 0):
+                    max_counts[key] = count
+        
+        correct = 0
+        weighted_correct = 0
+        for key, count in candidate_counts.items():
+            clipped = min(count, max_counts.get(key, 0))
+            correct += clipped
+            weighted_correct += candidate_weights[key] * clipped
+        return correct, total, weighted_correct, weighted_total
+    
+    _clipped_counts = _clipped_counts_kernel
+
+
+def _jit_kernel_ready(token_count: int) -> bool:
+    """Record `token_count` scored tokens and report whether the numba kernel should be used."""
+    global _jit_tokens_seen, _jit_loaded
+    if not _jit_loaded:
+        _jit_tokens_seen += token_count
+        if _jit_tokens_seen < JIT_MIN_TOKENS:
+            return False
+        with _jit_lock:
+            if not _jit_loaded:
+                _load_jit_kernel()
+                _jit_loaded = True
+    return _clipped_counts is not None
+
 
 class CodeBLEUEvaluator:
     """
     Main class for evaluating code generation quality using CodeBLEU metric.
     """
     
+    # Maximum number of distinct code strings whose parsed AST node types are memoized
+    AST_CACHE_SIZE = 2048
+    # Maximum number of distinct (code, language) pairs whose tokens and structures are memoized
+    TOKEN_CACHE_SIZE = 1024
+    
+    # Regexes are compiled once for the class rather than looked up on every call
+    _TOKEN_RE = re.compile(r'\b\w+\b|[^\w\s]')
+    _PY_COMMENT_RE = re.compile(r'#.*$', re.MULTILINE)
+    # Line and block comments in one alternation so JS/Java sources are stripped in one pass.
+    # The block comment body alternates runs of non-stars with star runs not followed by '/',
+    # which never overlap, so stripping stays linear; an unterminated block comment runs to
+    # end of input, as in the app's custom tokenizer.
+    _JS_COMMENT_RE = re.compile(r'//[^\n]*|/\*[^*]*(?:\*+(?!/)[^*]*)*(?:\*/|\Z)')
+    
+    # Control flow keywords across languages, matched against the (lowercased) token stream
+    _CF_KEYWORDS = frozenset({
+        'if', 'else', 'elif', 'for', 'while', 'try', 'catch', 'finally',
+        'switch', 'case', 'break', 'continue', 'return'
+    })
+    
+    _JS_STRUCT_PATTERNS = [
+        re.compile(r'function\s+(\w+)'),
+        re.compile(r'class\s+(\w+)'),
+        re.compile(r'(\w+)\s*:\s*function'),
+        re.compile(r'const\s+(\w+)\s*=\s*\([^)]*\)\s*=>')
+    ]
+    _JAVA_STRUCT_PATTERNS = [
+        re.compile(r'class\s+(\w+)'),
+        re.compile(r'interface\s+(\w+)'),
+        re.compile(r'public\s+\w+\s+(\w+)\s*\('),
+        re.compile(r'private\s+\w+\s+(\w+)\s*\(')
+    ]
+    
     def __init__(self, alpha: float = 0.25, beta: float = 0.25, gamma: float = 0.25, delta: float = 0.25):
         """
         Initialize CodeBLEU evaluator with weight parameters.
@@ -69,32 +244,47 @@ class CodeBLEUEvaluator:
         self.gamma = gamma
         self.delta = delta
         
-        # Language-specific keywords for weighted BLEU
+        # Token string -> integer id table; token streams are scored as tuples of these ids
+        self._vocab: Dict[str, int] = {}
+        self._keyword_id_cache: Dict[str, FrozenSet[int]] = {}
+        # (code, language) -> token ids; per instance because ids come from this instance's vocab
+        self._token_id_cache: Dict[Tuple[str, str], Tuple[int, ...]] = {}
+        
+        # Language-specific keywords for weighted BLEU; frozen so they cannot drift from the
+        # keyword id sets cached by _keyword_ids
         self.keywords = {
-            'python': {
+            'python': frozenset({
                 'def', 'class', 'if', 'else', 'elif', 'for', 'while', 'try', 'except', 
                 'finally', 'with', 'import', 'from', 'return', 'yield', 'lambda', 
                 'and', 'or', 'not', 'in', 'is', 'global', 'nonlocal', 'assert',
                 'break', 'continue', 'pass', 'raise', 'del', 'True', 'False', 'None'
-            },
-            'javascript': {
+            }),
+            'javascript': frozenset({
                 'function', 'var', 'let', 'const', 'if', 'else', 'for', 'while', 'do',
                 'switch', 'case', 'default', 'break', 'continue', 'return', 'try', 'catch',
                 'finally', 'throw', 'new', 'this', 'typeof', 'instanceof', 'in', 'of',
                 'true', 'false', 'null', 'undefined', 'class', 'extends', 'super',
                 'static', 'async', 'await', 'yield', 'import', 'export', 'from'
-            },
-            'java': {
+            }),
+            'java': frozenset({
                 'class', 'interface', 'enum', 'public', 'private', 'protected', 'static',
                 'final', 'abstract', 'synchronized', 'volatile', 'transient', 'native',
                 'if', 'else', 'for', 'while', 'do', 'switch', 'case', 'default',
                 'break', 'continue', 'return', 'try', 'catch', 'finally', 'throw',
                 'throws', 'new', 'this', 'super', 'instanceof', 'true', 'false', 'null'
-            }
+            })
         }
         
         logger.info(f"CodeBLEU evaluator initialized with weights: α={alpha}, β={beta}, γ={gamma}, δ={delta}")
     
+    def __getstate__(self) -> Dict[str, Any]:
+        # Caches are rebuilt on demand, so leave them out when shipping the evaluator to worker processes
+        state = self.__dict__.copy()
+        state['_vocab'] = {}
+        state['_keyword_id_cache'] = {}
+        state['_token_id_cache'] = {}
+        return state
+    
     def tokenize_code(self, code: str, language: str = 'python') -> List[str]:
         """
         Tokenize code into meaningful tokens for comparison.
@@ -106,20 +296,45 @@ class CodeBLEUEvaluator:
         Returns:
             List of tokens
         """
+        return list(self._tokenize(code, language))
+    
+    @staticmethod
+    @functools.lru_cache(maxsize=TOKEN_CACHE_SIZE)
+    def _tokenize(code: str, language: str) -> Tuple[str, ...]:
+        """Memoized tokenization shared by all scoring paths; returns an immutable tuple."""
         # Remove comments and normalize whitespace
         if language == 'python':
             # Remove Python comments
-            code = re.sub(r'#.*$', '', code, flags=re.MULTILINE)
+            code = CodeBLEUEvaluator._PY_COMMENT_RE.sub('', code)
         elif language in ['javascript', 'java']:
             # Remove single-line and multi-line comments
-            code = re.sub(r'//.*$', '', code, flags=re.MULTILINE)
-            code = re.sub(r'/\*.*?\*/', '', code, flags=re.DOTALL)
+            code = CodeBLEUEvaluator._JS_COMMENT_RE.sub('', code)
         
         # Tokenize on word boundaries, operators, and punctuation
-        tokens = re.findall(r'\b\w+\b|[^\w\s]', code.lower())
+        tokens = CodeBLEUEvaluator._TOKEN_RE.findall(code.lower())
         
         # Filter out empty tokens
-        return [token for token in tokens if token.strip()]
+        return tuple(token for token in tokens if token.strip())
+    
+    def _token_ids(self, code: str, language: str) -> Tuple[int, ...]:
+        """Memoized tokenization as integer ids, which hash and compare faster than strings."""
+        key = (code, language)
+        token_ids = self._token_id_cache.get(key)
+        if token_ids is None:
+            token_ids = tuple(self._encode_tokens(self._tokenize(code, language)))
+            if len(self._token_id_cache) >= self.TOKEN_CACHE_SIZE:
+                # Evict the oldest entry
+                del self._token_id_cache[next(iter(self._token_id_cache))]
+            self._token_id_cache[key] = token_ids
+        return token_ids
+    
+    def _keyword_ids(self, language: str) -> FrozenSet[int]:
+        """Integer ids of the language's keywords."""
+        keyword_ids = self._keyword_id_cache.get(language)
+        if keyword_ids is None:
+            keyword_ids = frozenset(self._encode_tokens(sorted(self.keywords.get(language, ()))))
+            self._keyword_id_cache[language] = keyword_ids
+        return keyword_ids
     
     def calculate_bleu_score(self, candidate: List[str], references: List[List[str]], 
                            max_n: int = 4) -> float:
@@ -134,40 +349,89 @@ class CodeBLEUEvaluator:
         Returns:
             BLEU score between 0 and 1
         """
-        if not candidate or not references:
-            return 0.0
-            
-        # Calculate n-gram precisions
+        return self._bleu_scores(self._encode_tokens(candidate), [self._encode_tokens(ref) for ref in references],
+                                 frozenset(), max_n)[0]
+    
+    def _bleu_scores(self, candidate: Sequence[int], references: List[Sequence[int]], keywords: AbstractSet[int],
+                     max_n: int = 4, reference_lengths: Optional[List[int]] = None,
+                     weighted_reference_lengths: Optional[List[int]] = None) -> Tuple[float, float]:
+        """
+        BLEU and keyword-weighted BLEU from a single n-gram counting pass over token ids.
+        
+        For the weighted score an n-gram containing a keyword counts twice, both in the clipped
+        matches and in the candidate total, and keywords count twice in the brevity penalty lengths.
+        Reference lengths can be passed in when already known, e.g. from `prepare_reference`.
+        """
+        # A candidate shorter than max_n has no max_n-grams, so that precision and BLEU are 0
+        if len(candidate) < max_n or not references:
+            return 0.0, 0.0
+        
+        # Calculate n-gram precisions, highest order first: any zero precision makes both
+        # scores 0, and sparse long n-grams are the likeliest to have no match at all
         precisions = []
+        weighted_precisions = []
+        jit_args = self._encode_for_jit(candidate, references, keywords, max_n)
         
-        for n in range(1, max_n + 1):
-            candidate_ngrams = self._get_ngrams(candidate, n)
-            reference_ngrams = [self._get_ngrams(ref, n) for ref in references]
-            
-            if not candidate_ngrams:
-                precisions.append(0.0)
-                continue
-            
-            # Count maximum occurrences in any reference
-            max_counts = defaultdict(int)
-            for ref_ngrams in reference_ngrams:
-                for ngram, count in ref_ngrams.items():
-                    max_counts[ngram] = max(max_counts[ngram], count)
-            
-            # Calculate precision
-            correct = 0
-            total = sum(candidate_ngrams.values())
+        for n in range(max_n, 0, -1):
+            if jit_args is not None:
+                correct, total, weighted_correct, weighted_total = _clipped_counts(*jit_args, n, len(self._vocab))
+            else:
+                candidate_ngrams, max_counts = self._ngram_stats(candidate, references, n)
+                correct = total = weighted_correct = weighted_total = 0
+                
+                for ngram, count in candidate_ngrams.items():
+                    clipped = min(count, max_counts[ngram])
+                    weight = 2 if any(token in keywords for token in ngram) else 1
+                    correct += clipped
+                    total += count
+                    weighted_correct += weight * clipped
+                    weighted_total += weight * count
             
-            for ngram, count in candidate_ngrams.items():
-                correct += min(count, max_counts[ngram])
+            # Keyword weights are at least 1, so the weighted precision is 0 exactly when this one is
+            if correct == 0:
+                return 0.0, 0.0
             
-            precision = correct / total if total > 0 else 0.0
-            precisions.append(precision)
+            precisions.append(correct / total)
+            weighted_precisions.append(weighted_correct / weighted_total)
+        
+        # Back to ascending order so the log-precision sum is taken in the usual order
+        precisions.reverse()
+        weighted_precisions.reverse()
         
-        # Calculate brevity penalty
-        candidate_length = len(candidate)
-        closest_ref_length = min(references, key=lambda ref: abs(len(ref) - candidate_length))
-        reference_length = len(closest_ref_length)
+        if reference_lengths is None:
+            reference_lengths = [len(ref) for ref in references]
+        if weighted_reference_lengths is None:
+            weighted_reference_lengths = [self._weighted_length(ref, keywords) for ref in references]
+        weighted_candidate_length = self._weighted_length(candidate, keywords)
+        
+        return (self._combine_bleu(precisions, len(candidate), reference_lengths),
+                self._combine_bleu(weighted_precisions, weighted_candidate_length, weighted_reference_lengths))
+    
+    @staticmethod
+    def _weighted_length(tokens: Sequence[int], keywords: AbstractSet[int]) -> int:
+        """Token count with keywords counted twice, as used for the weighted brevity penalty."""
+        return len(tokens) + sum(token in keywords for token in tokens)
+    
+    def _ngram_stats(self, candidate: Sequence[int], references: List[Sequence[int]], n: int) -> Tuple[Counter, Dict]:
+        """Candidate n-gram counts and the maximum count of each n-gram in any reference."""
+        candidate_ngrams = self._get_ngrams(candidate, n)
+        
+        # Count maximum occurrences in any reference
+        max_counts = defaultdict(int)
+        for ref in references:
+            for ngram, count in self._get_ngrams(ref, n).items():
+                max_counts[ngram] = max(max_counts[ngram], count)
+        
+        return candidate_ngrams, max_counts
+    
+    @staticmethod
+    def _combine_bleu(precisions: List[float], candidate_length: int, reference_lengths: List[int]) -> float:
+        """Combine n-gram precisions and lengths into a BLEU score with brevity penalty."""
+        # Calculate brevity penalty against the closest reference length
+        if len(reference_lengths) == 1:
+            reference_length = reference_lengths[0]
+        else:
+            reference_length = min(reference_lengths, key=lambda length: abs(length - candidate_length))
         
         if candidate_length > reference_length:
             brevity_penalty = 1.0
@@ -183,11 +447,42 @@ class CodeBLEUEvaluator:
         
         return brevity_penalty * geo_mean
     
+    def _encode_tokens(self, tokens: List[str]) -> List[int]:
+        """Map tokens to stable integer ids, growing the vocabulary as needed."""
+        vocab = self._vocab
+        return [vocab.setdefault(token, len(vocab)) for token in tokens]
+    
+    def _encode_for_jit(self, candidate: Sequence[int], references: List[Sequence[int]], keywords: AbstractSet[int],
+                        max_n: int) -> Optional[Tuple[Any, Any, Any, Any]]:
+        """
+        Pack candidate ids, its keyword flags and the reference ids into arrays for `_clipped_counts`.
+        
+        Returns None when the kernel is not in use (numba unavailable, or not enough tokens
+        scored yet) or the vocabulary is too large for max_n-grams to be packed exactly into
+        int64 keys.
+        """
+        if not _jit_kernel_ready(len(candidate) + sum(len(ref) for ref in references)):
+            return None
+        
+        cand_ids = np.array(candidate, dtype=np.int64)
+        ref_ids = np.array([i for ref in references for i in ref], dtype=np.int64)
+        ref_offsets = np.zeros(len(references) + 1, dtype=np.int64)
+        np.cumsum([len(ref) for ref in references], out=ref_offsets[1:])
+        
+        if len(self._vocab) ** max_n >= 2 ** 63:
+            return None
+        cand_keywords = np.array([token in keywords for token in candidate], dtype=np.bool_)
+        return cand_ids, cand_keywords, ref_ids, ref_offsets
+    
     def calculate_weighted_bleu_score(self, candidate: List[str], references: List[List[str]], 
                                     language: str = 'python') -> float:
         """
         Calculate weighted BLEU score giving more importance to keywords.
         
+        N-grams containing a keyword count twice in the matched and total n-gram counts.
+        The n-grams themselves are those of the plain token stream, so whenever plain BLEU
+        is 0 (some n-gram order has no match) the weighted score is 0 as well.
+        
         Args:
             candidate: Tokenized candidate
             references: List of tokenized references
@@ -196,23 +491,8 @@ class CodeBLEUEvaluator:
         Returns:
             Weighted BLEU score between 0 and 1
         """
-        keywords = self.keywords.get(language, set())
-        
-        # Create weighted versions of tokens
-        def weight_tokens(tokens: List[str]) -> List[str]:
-            weighted = []
-            for token in tokens:
-                if token in keywords:
-                    # Give keywords double weight by duplicating them
-                    weighted.extend([token, token])
-                else:
-                    weighted.append(token)
-            return weighted
-        
-        weighted_candidate = weight_tokens(candidate)
-        weighted_references = [weight_tokens(ref) for ref in references]
-        
-        return self.calculate_bleu_score(weighted_candidate, weighted_references)
+        return self._bleu_scores(self._encode_tokens(candidate), [self._encode_tokens(ref) for ref in references],
+                                 self._keyword_ids(language))[1]
     
     def calculate_ast_matching_score(self, candidate_code: str, reference_codes: List[str],
                                    language: str = 'python') -> float:
@@ -235,90 +515,109 @@ class CodeBLEUEvaluator:
     
     def _calculate_python_ast_score(self, candidate_code: str, reference_codes: List[str]) -> float:
         """Calculate AST matching score for Python code."""
-        try:
-            candidate_ast = ast.parse(candidate_code)
-            candidate_nodes = self._extract_ast_nodes(candidate_ast)
-        except SyntaxError:
+        return self._python_ast_score(candidate_code, [self._parse_python_ast_nodes(ref) for ref in reference_codes])
+    
+    def _python_ast_score(self, candidate_code: str, reference_nodes: List[Optional[int]]) -> float:
+        """Calculate AST matching score against already extracted reference node type bitsets."""
+        candidate_nodes = self._parse_python_ast_nodes(candidate_code)
+        if candidate_nodes is None:
             logger.warning("Candidate code has syntax errors, AST score will be 0")
             return 0.0
         
         max_score = 0.0
         
-        for ref_code in reference_codes:
-            try:
-                ref_ast = ast.parse(ref_code)
-                ref_nodes = self._extract_ast_nodes(ref_ast)
-                
-                # Calculate similarity based on common AST node types
-                if not candidate_nodes and not ref_nodes:
-                    score = 1.0
-                elif not candidate_nodes or not ref_nodes:
-                    score = 0.0
-                else:
-                    common_nodes = len(set(candidate_nodes) & set(ref_nodes))
-                    total_nodes = len(set(candidate_nodes) | set(ref_nodes))
-                    score = common_nodes / total_nodes if total_nodes > 0 else 0.0
-                
-                max_score = max(max_score, score)
-                
-            except SyntaxError:
+        for ref_nodes in reference_nodes:
+            if ref_nodes is None:
                 logger.warning("Reference code has syntax errors, skipping")
                 continue
+            
+            # Calculate similarity based on the AST node types present in both trees
+            common_nodes = (candidate_nodes & ref_nodes).bit_count()
+            total_nodes = (candidate_nodes | ref_nodes).bit_count()
+            score = common_nodes / total_nodes if total_nodes > 0 else 1.0
+            
+            max_score = max(max_score, score)
         
         return max_score
     
-    def _extract_ast_nodes(self, tree: ast.AST) -> List[str]:
-        """Extract AST node types from parsed tree."""
-        nodes = []
-        
-        for node in ast.walk(tree):
-            nodes.append(type(node).__name__)
-        
-        return nodes
+    @staticmethod
+    @functools.lru_cache(maxsize=AST_CACHE_SIZE)
+    def _parse_python_ast_nodes(code: str) -> Optional[int]:
+        """AST node type bitset of Python code, parsed once per distinct code string; None on syntax errors."""
+        try:
+            return CodeBLEUEvaluator._extract_ast_nodes(ast.parse(code))
+        except SyntaxError:
+            return None
+    
+    @staticmethod
+    def _extract_ast_nodes(tree: ast.AST) -> int:
+        """Bitset of the AST node types present in a parsed tree, with bits from `_AST_TYPE_BITS`."""
+        present = 0
+        
+        # Depth-first walk with a plain list as the stack; cheaper than ast.walk's deque
+        # and generator, and visit order does not matter for a set of types
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            present |= _AST_TYPE_BITS[type(node)]
+            stack.extend(ast.iter_child_nodes(node))
+        
+        return present
     
     def _calculate_structural_similarity(self, candidate: str, references: List[str], 
                                        language: str) -> float:
         """Calculate structural similarity for non-Python languages."""
         # Extract structural patterns (functions, classes, control structures)
         candidate_structures = self._extract_code_structures(candidate, language)
+        reference_structures = [self._extract_code_structures(ref, language) for ref in references]
         
+        return self._max_set_similarity(candidate_structures, reference_structures)
+    
+    def _max_set_similarity(self, candidate_items: FrozenSet[str],
+                            reference_items: List[FrozenSet[str]]) -> float:
+        """Best Jaccard similarity between the candidate's item set and any reference's item set."""
         max_score = 0.0
         
-        for ref in references:
-            ref_structures = self._extract_code_structures(ref, language)
-            
-            if not candidate_structures and not ref_structures:
+        for ref_items in reference_items:
+            if not candidate_items and not ref_items:
                 score = 1.0
-            elif not candidate_structures or not ref_structures:
+            elif not candidate_items or not ref_items:
                 score = 0.0
             else:
-                common = len(set(candidate_structures) & set(ref_structures))
-                total = len(set(candidate_structures) | set(ref_structures))
+                # Both sides are already sets, so only the intersection is built
+                common = len(candidate_items & ref_items)
+                total = len(candidate_items) + len(ref_items) - common
                 score = common / total if total > 0 else 0.0
             
             max_score = max(max_score, score)
         
         return max_score
     
-    def _extract_code_structures(self, code: str, language: str) -> List[str]:
-        """Extract code structures like functions, classes, etc."""
+    @staticmethod
+    @functools.lru_cache(maxsize=TOKEN_CACHE_SIZE)
+    def _extract_code_structures(code: str, language: str) -> FrozenSet[str]:
+        """Extract the set of code structures like functions, classes, etc. Memoized per (code, language)."""
+        if language in _TS_LANGUAGES:
+            # Parse with tree-sitter so names inside strings and comments are not picked up
+            tree = _ts_parser(language).parse(code.encode('utf-8'))
+            captures = QueryCursor(_TS_QUERIES[(language, 'structures')]).captures(tree.root_node)
+            return frozenset(node.text.decode('utf-8', 'replace') for node in captures.get('name', []))
+        
         structures = []
         
         if language == 'javascript':
             # Extract JavaScript structures
-            structures.extend(re.findall(r'function\s+(\w+)', code))
-            structures.extend(re.findall(r'class\s+(\w+)', code))
-            structures.extend(re.findall(r'(\w+)\s*:\s*function', code))
-            structures.extend(re.findall(r'const\s+(\w+)\s*=\s*\([^)]*\)\s*=>', code))
-        
+            patterns = CodeBLEUEvaluator._JS_STRUCT_PATTERNS
         elif language == 'java':
             # Extract Java structures
-            structures.extend(re.findall(r'class\s+(\w+)', code))
-            structures.extend(re.findall(r'interface\s+(\w+)', code))
-            structures.extend(re.findall(r'public\s+\w+\s+(\w+)\s*\(', code))
-            structures.extend(re.findall(r'private\s+\w+\s+(\w+)\s*\(', code))
+            patterns = CodeBLEUEvaluator._JAVA_STRUCT_PATTERNS
+        else:
+            patterns = []
         
-        return structures
+        for pattern in patterns:
+            structures.extend(pattern.findall(code))
+        
+        return frozenset(structures)
     
     def calculate_control_flow_score(self, candidate_code: str, reference_codes: List[str],
                                    language: str = 'python') -> float:
@@ -333,61 +632,29 @@ class CodeBLEUEvaluator:
         Returns:
             Control flow matching score between 0 and 1
         """
-        candidate_cf = self._extract_control_flow(candidate_code, language)
-        
-        max_score = 0.0
-        
-        for ref_code in reference_codes:
-            ref_cf = self._extract_control_flow(ref_code, language)
-            
-            if not candidate_cf and not ref_cf:
-                score = 1.0
-            elif not candidate_cf or not ref_cf:
-                score = 0.0
-            else:
-                # Calculate similarity of control flow patterns
-                common = len(set(candidate_cf) & set(ref_cf))
-                total = len(set(candidate_cf) | set(ref_cf))
-                score = common / total if total > 0 else 0.0
-            
-            max_score = max(max_score, score)
+        candidate_cf = self._extract_control_flow(self._tokenize(candidate_code, language))
+        reference_cf = [self._extract_control_flow(self._tokenize(ref_code, language)) for ref_code in reference_codes]
         
-        return max_score
+        # Calculate similarity of control flow patterns
+        return self._max_set_similarity(candidate_cf, reference_cf)
     
-    def _extract_control_flow(self, code: str, language: str) -> List[str]:
-        """Extract control flow constructs from code."""
-        control_flow = []
-        
-        # Common control flow patterns across languages
-        patterns = [
-            r'\bif\s*\(',
-            r'\belse\b',
-            r'\belif\s*\(',
-            r'\bfor\s*\(',
-            r'\bwhile\s*\(',
-            r'\btry\b',
-            r'\bcatch\b',
-            r'\bfinally\b',
-            r'\bswitch\s*\(',
-            r'\bcase\s+',
-            r'\bbreak\b',
-            r'\bcontinue\b',
-            r'\breturn\b'
-        ]
-        
-        for pattern in patterns:
-            matches = re.findall(pattern, code, re.IGNORECASE)
-            control_flow.extend(matches)
-        
-        return control_flow
+    def _extract_control_flow(self, tokens: Sequence[str]) -> FrozenSet[str]:
+        """Extract the control flow keywords used in an already tokenized (comment-free) token stream."""
+        return self._CF_KEYWORDS.intersection(tokens)
     
     def _get_ngrams(self, tokens: List[str], n: int) -> Counter:
         """Generate n-grams from token list."""
-        ngrams = []
-        for i in range(len(tokens) - n + 1):
-            ngram = tuple(tokens[i:i + n])
-            ngrams.append(ngram)
-        return Counter(ngrams)
+        return Counter(self._iter_ngrams(tokens, n))
+    
+    @staticmethod
+    def _iter_ngrams(tokens: Sequence, n: int) -> Iterator[Tuple]:
+        """
+        Iterate over the n-grams of a sequence as tuples.
+        
+        Zipping n shifted copies builds every tuple in C, with no slice or tuple() call
+        per position.
+        """
+        return zip(*[tokens[k:] for k in range(n)])
     
     def detect_language(self, code: str) -> str:
         """
@@ -439,16 +706,74 @@ class CodeBLEUEvaluator:
         
         logger.info(f"Evaluating code with language: {language}")
         
-        # Tokenize code
-        candidate_tokens = self.tokenize_code(candidate_code, language)
-        reference_tokens_list = [self.tokenize_code(ref, language) for ref in reference_codes]
+        references = [self.prepare_reference(ref, language) for ref in reference_codes]
+        results = self.evaluate_prepared(candidate_code, references, language)
+        
+        logger.info(f"Evaluation results: CodeBLEU={results['codebleu']:.3f}")
+        return results
+    
+    def prepare_reference(self, reference_code: str, language: str) -> Dict[str, Any]:
+        """
+        Precompute everything scoring needs from a reference, so a reference compared
+        against many candidates is tokenized, parsed and scanned only once.
+        
+        Args:
+            reference_code: Reference code string
+            language: Programming language
+            
+        Returns:
+            Dictionary of reference artifacts for `evaluate_prepared`
+        """
+        token_ids = self._token_ids(reference_code, language)
+        artifacts = {
+            'token_ids': token_ids,
+            'length': len(token_ids),
+            'weighted_length': self._weighted_length(token_ids, self._keyword_ids(language)),
+            'cf': self._extract_control_flow(self._tokenize(reference_code, language))
+        }
+        if language == 'python':
+            artifacts['ast_nodes'] = self._parse_python_ast_nodes(reference_code)
+        else:
+            artifacts['structures'] = self._extract_code_structures(reference_code, language)
+        return artifacts
+    
+    def evaluate_prepared(self, candidate_code: str, references: List[Dict[str, Any]],
+                          language: str) -> Dict[str, Any]:
+        """
+        Evaluate generated code against references prepared with `prepare_reference`.
         
-        # Calculate individual scores
-        bleu_score = self.calculate_bleu_score(candidate_tokens, reference_tokens_list)
-        weighted_bleu_score = self.calculate_weighted_bleu_score(candidate_tokens, reference_tokens_list, language)
-        ast_score = self.calculate_ast_matching_score(candidate_code, reference_codes, language)
-        cf_score = self.calculate_control_flow_score(candidate_code, reference_codes, language)
+        Args:
+            candidate_code: Generated code to evaluate
+            references: Prepared reference artifacts
+            language: Programming language the references were prepared with
+            
+        Returns:
+            Dictionary containing all scores and final CodeBLEU score
+        """
+        candidate_ids = self._token_ids(candidate_code, language)
+        reference_ids_list = [ref['token_ids'] for ref in references]
+        # Both BLEU variants come from the same n-gram counts
+        bleu_score, weighted_bleu_score = self._bleu_scores(
+            candidate_ids, reference_ids_list, self._keyword_ids(language),
+            reference_lengths=[ref['length'] for ref in references],
+            weighted_reference_lengths=[ref['weighted_length'] for ref in references]
+        )
         
+        if language == 'python':
+            ast_score = self._python_ast_score(candidate_code, [ref['ast_nodes'] for ref in references])
+        else:
+            # For non-Python languages, use structural similarity based on patterns
+            ast_score = self._max_set_similarity(self._extract_code_structures(candidate_code, language),
+                                                 [ref['structures'] for ref in references])
+        
+        cf_score = self._max_set_similarity(self._extract_control_flow(self._tokenize(candidate_code, language)),
+                                            [ref['cf'] for ref in references])
+        
+        return self._compose_results(bleu_score, weighted_bleu_score, ast_score, cf_score, language)
+    
+    def _compose_results(self, bleu_score: float, weighted_bleu_score: float, ast_score: float,
+                         cf_score: float, language: str) -> Dict[str, Any]:
+        """Weight the component scores into the final CodeBLEU score and results dict."""
         # Calculate final CodeBLEU score
         codebleu_score = (
             self.alpha * bleu_score +
@@ -457,7 +782,7 @@ class CodeBLEUEvaluator:
             self.delta * cf_score
         )
         
-        results = {
+        return {
             'codebleu': codebleu_score,
             'bleu': bleu_score,
             'weighted_bleu': weighted_bleu_score,
@@ -471,9 +796,6 @@ class CodeBLEUEvaluator:
                 'delta': self.delta
             }
         }
-        
-        logger.info(f"Evaluation results: CodeBLEU={codebleu_score:.3f}")
-        return results
 
 
 class CodeBLEUDatasetEvaluator:
@@ -481,6 +803,12 @@ class CodeBLEUDatasetEvaluator:
     Evaluate CodeBLEU scores on a dataset of code pairs.
     """
     
+    # Pairs handed to a worker process at a time; references are prepared once per chunk
+    CHUNK_SIZE = 32
+    
+    # Threads used to read dataset files concurrently
+    READ_WORKERS = 16
+    
     def __init__(self, evaluator: CodeBLEUEvaluator):
         self.evaluator = evaluator
         self.results = []
@@ -502,33 +830,45 @@ class CodeBLEUDatasetEvaluator:
             logger.error(f"Directory not found: {generated_dir} or {reference_dir}")
             return dataset
         
-        generated_files = sorted(os.listdir(generated_dir))
-        reference_files = sorted(os.listdir(reference_dir))
+        # scandir reports the entry type with the name, so is_file() needs no extra stat
+        with os.scandir(generated_dir) as it:
+            generated_entries = sorted(it, key=lambda entry: entry.name)
+        with os.scandir(reference_dir) as it:
+            reference_entries = sorted(it, key=lambda entry: entry.name)
         
-        for gen_file, ref_file in zip(generated_files, reference_files):
-            gen_path = os.path.join(generated_dir, gen_file)
-            ref_path = os.path.join(reference_dir, ref_file)
-            
-            if os.path.isfile(gen_path) and os.path.isfile(ref_path):
-                try:
-                    with open(gen_path, 'r', encoding='utf-8') as f:
-                        generated_code = f.read()
-                    with open(ref_path, 'r', encoding='utf-8') as f:
-                        reference_code = f.read()
-                    
-                    dataset.append((generated_code, reference_code))
-                except Exception as e:
-                    logger.warning(f"Error reading files {gen_file}, {ref_file}: {e}")
+        file_pairs = [(gen_entry, ref_entry) for gen_entry, ref_entry in zip(generated_entries, reference_entries)
+                      if gen_entry.is_file() and ref_entry.is_file()]
+        
+        # Reads are I/O bound, so overlap them on a thread pool
+        with ThreadPoolExecutor(max_workers=self.READ_WORKERS) as executor:
+            for pair in executor.map(self._read_pair, file_pairs):
+                if pair is not None:
+                    dataset.append(pair)
         
         logger.info(f"Loaded {len(dataset)} code pairs from dataset")
         return dataset
     
-    def evaluate_dataset(self, dataset: List[Tuple[str, str]]) -> Dict[str, Any]:
+    @staticmethod
+    def _read_pair(entries: Tuple[os.DirEntry, os.DirEntry]) -> Optional[Tuple[str, str]]:
+        """Read a (generated, reference) file pair, or None if either cannot be read."""
+        gen_entry, ref_entry = entries
+        try:
+            with open(gen_entry.path, 'rb') as f:
+                generated_code = f.read().decode('utf-8')
+            with open(ref_entry.path, 'rb') as f:
+                reference_code = f.read().decode('utf-8')
+            return generated_code, reference_code
+        except Exception as e:
+            logger.warning(f"Error reading files {gen_entry.name}, {ref_entry.name}: {e}")
+            return None
+    
+    def evaluate_dataset(self, dataset: List[Tuple[str, str]], max_workers: Optional[int] = None) -> Dict[str, Any]:
         """
         Evaluate CodeBLEU scores on entire dataset.
         
         Args:
             dataset: List of (generated_code, reference_code) tuples
+            max_workers: Worker processes to spread the pairs over (defaults to the CPU count; 1 disables)
             
         Returns:
             Dictionary with aggregated results
@@ -537,13 +877,24 @@ class CodeBLEUDatasetEvaluator:
             logger.error("Empty dataset provided")
             return {}
         
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        
+        if max_workers > 1 and len(dataset) > self.CHUNK_SIZE:
+            # Pairs are independent, so score chunks of them in parallel processes
+            offsets = list(range(0, len(dataset), self.CHUNK_SIZE))
+            chunks = [dataset[offset:offset + self.CHUNK_SIZE] for offset in offsets]
+            with ProcessPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+                chunk_scores = list(executor.map(_evaluate_chunk_worker, repeat(self.evaluator), chunks,
+                                                 offsets, repeat(len(dataset))))
+        else:
+            chunk_scores = [self._evaluate_pairs(dataset, 0, len(dataset))]
+        
         individual_scores = []
         
-        for i, (generated, reference) in enumerate(dataset):
-            logger.info(f"Evaluating pair {i+1}/{len(dataset)}")
-            
-            try:
-                scores = self.evaluator.evaluate(generated, reference)
+        for chunk in chunk_scores:
+            for i, scores in chunk:
+                generated, reference = dataset[i]
                 individual_scores.append(scores)
                 self.results.append({
                     'index': i,
@@ -551,9 +902,6 @@ class CodeBLEUDatasetEvaluator:
                     'generated_code': generated,
                     'reference_code': reference
                 })
-            except Exception as e:
-                logger.error(f"Error evaluating pair {i}: {e}")
-                continue
         
         if not individual_scores:
             logger.error("No valid evaluations completed")
@@ -565,11 +913,13 @@ class CodeBLEUDatasetEvaluator:
         
         for metric in metrics:
             values = [scores[metric] for scores in individual_scores]
+            # Compute the mean once; recomputing it inside the deviation sum made std quadratic
+            mean = sum(values) / len(values)
             aggregated[metric] = {
-                'mean': sum(values) / len(values),
+                'mean': mean,
                 'max': max(values),
                 'min': min(values),
-                'std': (sum((x - sum(values)/len(values))**2 for x in values) / len(values))**0.5
+                'std': (sum((x - mean)**2 for x in values) / len(values))**0.5
             }
         
         aggregated['total_pairs'] = len(individual_scores)
@@ -578,6 +928,36 @@ class CodeBLEUDatasetEvaluator:
         logger.info(f"Dataset evaluation completed. Mean CodeBLEU: {aggregated['codebleu']['mean']:.3f}")
         return aggregated
     
+    def _evaluate_pairs(self, pairs: List[Tuple[str, str]], offset: int, total: int) -> List[Tuple[int, Dict[str, Any]]]:
+        """
+        Score a run of dataset pairs, returning (dataset index, scores) for each pair that
+        evaluated successfully. `offset` is the dataset index of the first pair.
+        """
+        evaluator = self.evaluator
+        
+        # Prepare each distinct reference once, however many candidates it is scored against
+        ref_artifacts: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        scored = []
+        
+        for i, (generated, reference) in enumerate(pairs):
+            logger.info(f"Evaluating pair {offset + i + 1}/{total}")
+            
+            # Preparation parses the reference, so it stays inside the per-pair error handling
+            # and a reference that cannot be processed only skips the pairs that use it
+            try:
+                language = evaluator.detect_language(generated)
+                prepared = ref_artifacts.get((reference, language))
+                if prepared is None:
+                    prepared = evaluator.prepare_reference(reference, language)
+                    ref_artifacts[(reference, language)] = prepared
+                scores = evaluator.evaluate_prepared(generated, [prepared], language)
+                scored.append((offset + i, scores))
+            except Exception as e:
+                logger.error(f"Error evaluating pair {offset + i}: {e}")
+                continue
+        
+        return scored
+    
     def save_results(self, filepath: str):
         """Save evaluation results to JSON file."""
         try:
@@ -588,15 +968,37 @@ class CodeBLEUDatasetEvaluator:
             logger.error(f"Error saving results: {e}")
 
 
+def _evaluate_chunk_worker(evaluator: CodeBLEUEvaluator, pairs: List[Tuple[str, str]],
+                           offset: int, total: int) -> List[Tuple[int, Dict[str, Any]]]:
+    """Score one chunk of a dataset inside a worker process."""
+    return CodeBLEUDatasetEvaluator(evaluator)._evaluate_pairs(pairs, offset, total)
+
+
 class ChatbotCodeEvaluator:
     """
     Evaluate code generated by the chatbot server using CodeBLEU.
     """
     
+    # Requests in flight at once in evaluate_prompts_batch; also the HTTP connection pool size
+    MAX_CONCURRENT_REQUESTS = 16
+    
+    # First fenced markdown code block in a chatbot response
+    _CODE_BLOCK_RE = re.compile(r'```(?:\w+)?\n(.*?)```', re.DOTALL)
+    
     def __init__(self, server_url: str = "http://localhost:3000", evaluator: CodeBLEUEvaluator = None):
         self.server_url = server_url.rstrip('/')
         self.evaluator = evaluator or CodeBLEUEvaluator()
         self.session_id = f"eval_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        
+        # One keep-alive session for all API calls, so connections are reused across prompts
+        self._http = None
+        if requests:
+            self._http = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.MAX_CONCURRENT_REQUESTS,
+                                  pool_maxsize=self.MAX_CONCURRENT_REQUESTS,
+                                  max_retries=Retry(total=3, backoff_factor=0.2))
+            self._http.mount('http://', adapter)
+            self._http.mount('https://', adapter)
     
     def generate_code_from_prompt(self, prompt: str) -> Optional[str]:
         """
@@ -613,7 +1015,7 @@ class ChatbotCodeEvaluator:
             return None
         
         try:
-            response = requests.post(
+            response = self._http.post(
                 f"{self.server_url}/api/chat",
                 json={
                     "message": prompt,
@@ -651,11 +1053,26 @@ class ChatbotCodeEvaluator:
             return None
         
         # Extract actual code from response (remove markdown formatting)
-        code_match = re.search(r'```(?:\w+)?\n(.*?)```', generated_code, re.DOTALL)
+        code_match = self._CODE_BLOCK_RE.search(generated_code) if '```' in generated_code else None
         if code_match:
             generated_code = code_match.group(1).strip()
         
         return self.evaluator.evaluate(generated_code, reference_code)
+    
+    def evaluate_prompts_batch(self, prompts: List[str],
+                               reference_codes: List[str]) -> List[Optional[Dict[str, float]]]:
+        """
+        Evaluate many prompts against their references, with several API calls in flight at once.
+        
+        Args:
+            prompts: Code generation prompts
+            reference_codes: Reference implementation for each prompt
+            
+        Returns:
+            Evaluation results (or None if failed) in prompt order
+        """
+        with ThreadPoolExecutor(max_workers=self.MAX_CONCURRENT_REQUESTS) as executor:
+            return list(executor.map(self.evaluate_prompt_with_reference, prompts, reference_codes))
 
 
 def main():